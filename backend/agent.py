@@ -2,28 +2,89 @@
 Production-grade LangGraph agent for NYC 311 data analysis
 """
 import pandas as pd
-from typing import TypedDict, Annotated, Literal
+from typing import TypedDict, Annotated, Literal, AsyncIterator, Optional
 from langgraph.graph import StateGraph, END
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, SystemMessage
 import os
+import asyncio
+import hashlib
+import httpx
+import operator
+import re
+from collections import OrderedDict
 from tools import DataAnalysisTools
 
+# Seconds before an LLM request is abandoned (and retried by the client)
+LLM_TIMEOUT = 60
+
+# One pooled HTTP/2 client per (base_url, api_key), shared by every agent in the process
+_HTTP_CLIENTS: dict[tuple, httpx.AsyncClient] = {}
+
+def get_http_client(base_url: Optional[str], api_key: Optional[str]) -> httpx.AsyncClient:
+    """Return the shared async HTTP client for an LLM endpoint, creating it on first use"""
+    key = (base_url, api_key)
+    client = _HTTP_CLIENTS.get(key)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+            timeout=LLM_TIMEOUT
+        )
+        _HTTP_CLIENTS[key] = client
+    return client
+
+async def close_http_clients():
+    """Close all shared HTTP clients (called on server shutdown)"""
+    for client in _HTTP_CLIENTS.values():
+        await client.aclose()
+    _HTTP_CLIENTS.clear()
+
+# Number of answered queries kept for instant replay
+RESULT_CACHE_SIZE = 128
+
+# Phrases accepted by the query templates, mapped to dataset columns
+TEMPLATE_COLUMNS = {
+    'complaint types': 'Complaint Type',
+    'boroughs': 'Borough', 'borough': 'Borough',
+    'agencies': 'Agency', 'agency': 'Agency',
+    'statuses': 'Status', 'status': 'Status'
+}
+
+# Aggregates DataAnalysisTools precomputes, by column
+PRECOMPUTED_COUNTS = {
+    'Complaint Type': '_top_complaints',
+    'Borough': '_top_boroughs'
+}
+
+# Small, JSON-friendly state fields forwarded to clients as each step finishes
+STREAMED_FIELDS = (
+    "analysis_plan", "pandas_code", "error", "needs_visualization",
+    "visualization_code", "visualization_error", "response", "analysis_trace"
+)
+
 class AgentState(TypedDict):
-    """State for the agent workflow"""
+    """
+    State for the agent workflow
+    
+    Nodes return only the keys they change. Invariant data such as the dataset
+    context lives on the agent instead of being carried through every step.
+    """
     query: str
-    dataset_context: str
     analysis_plan: str
     pandas_code: str
     execution_result: dict
     needs_visualization: bool
     visualization_code: str
     visualization_image: str
+    visualization_format: str
     visualization_error: str
     visualization_retry_count: int
+    response_draft: Annotated[str, operator.add]
     response: str
     error: str
     retry_count: int
+    analysis_trace: Annotated[list[str], operator.add]
 
 class NYC311AnalyticsAgent:
     """Production-grade analytics agent using LangGraph"""
@@ -32,15 +93,51 @@ class NYC311AnalyticsAgent:
         self.df = df
         self.tools = DataAnalysisTools(df)
         
-        # Initialize DeepSeek LLM
+        # Dataset context is computed once and reused verbatim so every prompt
+        # shares a byte-identical prefix that the provider can cache
+        self.dataset_context = self.tools.get_dataset_context()
+        self._cache_key = hashlib.sha256(self.dataset_context.encode("utf-8")).hexdigest()[:32]
+        
+        # Initialize DeepSeek LLM over the shared connection pool; transient failures
+        # are retried by the client with exponential backoff
+        api_key = os.getenv("DEEPSEEK_API_KEY")
+        base_url = os.getenv("DEEPSEEK_BASE_URL")
         self.llm = ChatOpenAI(
             model="deepseek-chat",
-            api_key=os.getenv("DEEPSEEK_API_KEY"),
-            base_url=os.getenv("DEEPSEEK_BASE_URL"),
+            api_key=api_key,
+            base_url=base_url,
+            http_async_client=get_http_client(base_url, api_key),
+            # Must be set here too: ChatOpenAI's default of None overrides the client timeout per request
+            timeout=LLM_TIMEOUT,
+            max_retries=2,
             temperature=0.1,
-            max_tokens=2000
+            max_tokens=2000,
+            streaming=True,  # Lets stream_query forward tokens as they arrive
+            extra_body={"prompt_cache_key": self._cache_key}
         )
         
+        # Successful results keyed by normalized query; the agent is rebuilt whenever
+        # the dataset is reloaded, so entries never outlive the data they describe
+        self._result_cache: OrderedDict[str, dict] = OrderedDict()
+        
+        # Common question shapes answered directly with pandas, without any LLM call.
+        # Patterns must match the whole normalized query so extra conditions
+        # ("... in Brooklyn") always fall through to the full agent.
+        self._templates = [
+            (
+                re.compile(r'(?:(?:what are|show(?: me)?|list|give me) )?(?:the )?top ([1-9]\d*) '
+                           r'(complaint types|boroughs|agencies)'
+                           r'(?: by (?:count|volume|number of (?:complaints|requests)))?'),
+                self._top_n_template
+            ),
+            (
+                re.compile(r'(?:(?:show(?: me)?|count|number of|how many) )?(?:the )?'
+                           r'(?:complaints|requests|service requests)(?: count)? (?:by|per) '
+                           r'(borough|agency|status)'),
+                self._count_by_template
+            )
+        ]
+        
         # Build workflow graph
         self.graph = self._build_graph()
     
@@ -56,6 +153,8 @@ class NYC311AnalyticsAgent:
         workflow.add_node("decide_visualization", self.decide_visualization)
         workflow.add_node("generate_visualization", self.generate_visualization)
         workflow.add_node("retry_visualization", self.retry_visualization)
+        workflow.add_node("visualization_done", self.visualization_done)
+        workflow.add_node("draft_response", self.draft_response)
         workflow.add_node("format_response", self.format_response)
         
         # Define edges
@@ -75,14 +174,12 @@ class NYC311AnalyticsAgent:
         
         workflow.add_edge("retry_code", "execute_code")
         
-        # Conditional edge: create visualization only if needed
+        # Conditional edge: create visualization only if needed; when it is,
+        # the response draft is generated in parallel with the chart
         workflow.add_conditional_edges(
             "decide_visualization",
             self.should_visualize,
-            {
-                "visualize": "generate_visualization",
-                "skip": "format_response"
-            }
+            ["generate_visualization", "draft_response", "format_response"]
         )
         
         # Conditional edge: retry visualization if it fails
@@ -91,26 +188,24 @@ class NYC311AnalyticsAgent:
             self.should_retry_visualization,
             {
                 "retry": "retry_visualization",
-                "continue": "format_response"
+                "continue": "visualization_done"
             }
         )
         
         workflow.add_edge("retry_visualization", "generate_visualization")
+        
+        # Wait for both parallel branches before formatting the final response
+        workflow.add_edge(["visualization_done", "draft_response"], "format_response")
         workflow.add_edge("format_response", END)
         
         return workflow.compile()
     
-    def plan_analysis(self, state: AgentState) -> AgentState:
+    async def plan_analysis(self, state: AgentState) -> dict:
         """Step 1: Understand query and plan analysis approach"""
         
-        dataset_context = self.tools.get_dataset_context()
-        
         messages = [
             SystemMessage(content=f"""You are an expert data analyst specializing in NYC 311 service request data.
 
-DATASET INFORMATION:
-{dataset_context}
-
 Your task: Analyze the user's question and create a clear, step-by-step analysis plan.
 
 Consider:
@@ -119,33 +214,31 @@ Consider:
 3. Are there any data cleaning steps needed?
 4. What's the best way to present the results?
 
-Provide a concise but complete analysis plan."""),
+Provide a concise but complete analysis plan.
+
+DATASET INFORMATION:
+{self.dataset_context}"""),
             HumanMessage(content=f"User Question: {state['query']}")
         ]
         
-        response = self.llm.invoke(messages)
-        state["analysis_plan"] = response.content
-        state["dataset_context"] = dataset_context
-        state["retry_count"] = 0
-        state["visualization_retry_count"] = 0
-        state["needs_visualization"] = False
-        state["visualization_error"] = ""
+        response = await self.llm.ainvoke(messages)
         
-        return state
+        return {
+            "analysis_plan": response.content,
+            "retry_count": 0,
+            "visualization_retry_count": 0,
+            "needs_visualization": False,
+            "visualization_error": "",
+            "analysis_trace": ["plan_analysis: planned"]
+        }
     
-    def generate_code(self, state: AgentState) -> AgentState:
+    async def generate_code(self, state: AgentState) -> dict:
         """Step 2: Generate pandas code based on the plan"""
         
         messages = [
             SystemMessage(content=f"""You are an expert Python programmer specializing in pandas data analysis.
 
-DATASET CONTEXT:
-{state['dataset_context']}
-
-ANALYSIS PLAN:
-{state['analysis_plan']}
-
-Generate clean, efficient pandas code to execute this analysis.
+Generate clean, efficient pandas code to execute the analysis plan provided by the user.
 
 CRITICAL REQUIREMENTS:
 1. The DataFrame is available as 'df' (already imported)
@@ -154,7 +247,14 @@ CRITICAL REQUIREMENTS:
 4. Handle missing/null values appropriately
 5. Use efficient pandas operations
 6. Add comments explaining complex operations
-7. Return ONLY the Python code, no explanations
+7. Reuse the precomputed objects listed in the dataset context instead of recomputing them
+8. When grouping by 'category' dtype columns, pass observed=True to groupby
+9. Avoid row-wise df.apply; use vectorized operations or the compiled helpers in 'jit':
+   - jit.resolution_hours(df['Created Date'].values, df['Closed Date'].values) -> hours per request (NaN if open)
+   - jit.groupby_mean_by_code(df[col].cat.codes.values, values, len(df[col].cat.categories)) -> mean per category
+   - jit.mean_resolution_hours_by(df, col) -> Series of mean resolution hours per category of col
+   - For large rolling windows use .rolling(...).mean(engine='numba')
+10. Return ONLY the Python code, no explanations
 
 EXAMPLE FORMAT:
 ```python
@@ -165,11 +265,17 @@ filtered_df = df[df['Status'].notna()]
 result = filtered_df['Complaint Type'].value_counts().head(10)
 ```
 
-Generate the code now:"""),
-            HumanMessage(content=f"User Query: {state['query']}")
+DATASET CONTEXT:
+{self.dataset_context}"""),
+            HumanMessage(content=f"""User Query: {state['query']}
+
+ANALYSIS PLAN:
+{state['analysis_plan']}
+
+Generate the code now:""")
         ]
         
-        response = self.llm.invoke(messages)
+        response = await self.llm.ainvoke(messages)
         
         # Extract code
         code = response.content
@@ -178,21 +284,28 @@ Generate the code now:"""),
         elif "```" in code:
             code = code.split("```")[1].split("```")[0]
         
-        state["pandas_code"] = code.strip()
-        return state
+        return {
+            "pandas_code": code.strip(),
+            "analysis_trace": ["generate_code: generated"]
+        }
     
-    def execute_code(self, state: AgentState) -> AgentState:
+    async def execute_code(self, state: AgentState) -> dict:
         """Step 3: Execute the generated pandas code"""
         
-        execution_result = self.tools.execute_pandas_code(state["pandas_code"])
-        state["execution_result"] = execution_result
+        # Off the event loop: analysis over the full dataset must not stall other requests/streams
+        execution_result = await asyncio.to_thread(self.tools.execute_pandas_code, state["pandas_code"])
         
         if not execution_result["success"]:
-            state["error"] = execution_result["error"]
-        else:
-            state["error"] = ""
-        
-        return state
+            return {
+                "execution_result": execution_result,
+                "error": execution_result["error"],
+                "analysis_trace": ["execute_code: failed"]
+            }
+        return {
+            "execution_result": execution_result,
+            "error": "",
+            "analysis_trace": [f"execute_code: {execution_result['result_type']}"]
+        }
     
     def should_retry(self, state: AgentState) -> Literal["retry", "continue"]:
         """Decide whether to retry code generation"""
@@ -200,13 +313,24 @@ Generate the code now:"""),
             return "retry"
         return "continue"
     
-    def retry_code(self, state: AgentState) -> AgentState:
+    async def retry_code(self, state: AgentState) -> dict:
         """Step 3b: Retry code generation with error feedback"""
         
-        state["retry_count"] += 1
-        
         messages = [
-            SystemMessage(content=f"""The previous code failed. Fix the error and generate corrected code.
+            SystemMessage(content=f"""You are an expert Python programmer specializing in pandas data analysis.
+
+The previous code failed. Fix the error and generate corrected code.
+
+Generate CORRECTED Python code that:
+1. Fixes the error
+2. Handles edge cases
+3. Still stores result in 'result' variable
+
+Return ONLY the corrected Python code.
+
+DATASET CONTEXT:
+{self.dataset_context}"""),
+            HumanMessage(content=f"""User Query: {state['query']}
 
 PREVIOUS CODE:
 ```python
@@ -216,19 +340,10 @@ PREVIOUS CODE:
 ERROR:
 {state['error']}
 
-DATASET CONTEXT:
-{state['dataset_context']}
-
-Generate CORRECTED Python code that:
-1. Fixes the error
-2. Handles edge cases
-3. Still stores result in 'result' variable
-
-Return ONLY the corrected Python code:"""),
-            HumanMessage(content="Generate the corrected code now.")
+Generate the corrected code now.""")
         ]
         
-        response = self.llm.invoke(messages)
+        response = await self.llm.ainvoke(messages)
         
         # Extract code
         code = response.content
@@ -237,15 +352,17 @@ Return ONLY the corrected Python code:"""),
         elif "```" in code:
             code = code.split("```")[1].split("```")[0]
         
-        state["pandas_code"] = code.strip()
-        return state
+        return {
+            "pandas_code": code.strip(),
+            "retry_count": state["retry_count"] + 1,
+            "analysis_trace": [f"retry_code: attempt {state['retry_count'] + 1}"]
+        }
     
-    def decide_visualization(self, state: AgentState) -> AgentState:
+    async def decide_visualization(self, state: AgentState) -> dict:
         """Step 4: Decide if visualization is needed"""
         
         if state["error"]:
-            state["needs_visualization"] = False
-            return state
+            return {"needs_visualization": False}
         
         messages = [
             SystemMessage(content="""You are a data visualization expert. Decide if a chart/graph would enhance understanding.
@@ -268,50 +385,37 @@ Respond with ONLY 'YES' or 'NO'."""),
             HumanMessage(content=f"""User Query: {state['query']}
 
 Result Type: {state['execution_result'].get('result_type')}
-Result Preview: {str(state['execution_result'].get('result'))[:200]}
+Result Preview: {(state['execution_result'].get('result_preview') or '')[:200]}
 
 Should we create a visualization? Answer YES or NO only.""")
         ]
         
-        response = self.llm.invoke(messages)
+        response = await self.llm.ainvoke(messages)
         decision = response.content.strip().upper()
         
-        state["needs_visualization"] = "YES" in decision
+        needs_visualization = "YES" in decision
         
-        return state
+        return {
+            "needs_visualization": needs_visualization,
+            "analysis_trace": [f"decide_visualization: {'chart' if needs_visualization else 'no chart'}"]
+        }
     
-    def should_visualize(self, state: AgentState) -> Literal["visualize", "skip"]:
-        """Router: decide visualization path"""
+    def should_visualize(self, state: AgentState) -> list[str]:
+        """Router: fan out to visualization and response drafting, or skip straight to the response"""
         if state["needs_visualization"] and not state["error"]:
-            return "visualize"
-        return "skip"
+            return ["generate_visualization", "draft_response"]
+        return ["format_response"]
     
-    def generate_visualization(self, state: AgentState) -> AgentState:
+    async def generate_visualization(self, state: AgentState) -> dict:
         """Step 5: Generate and execute visualization code"""
         
         # Get the actual pandas code that was executed
         pandas_code = state["pandas_code"]
         
-        # Build the prompt based on whether this is a retry
+        # Build the prompt based on whether this is a retry; the system prompts
+        # are fully static and every per-query detail goes in the user message
         if state["visualization_retry_count"] > 0:
-            system_message = f"""You are a data visualization expert. The previous visualization code FAILED with an error.
-
-PREVIOUS VISUALIZATION CODE THAT FAILED:
-```python
-{state['visualization_code']}
-```
-
-ERROR MESSAGE:
-{state['visualization_error']}
-
-ORIGINAL ANALYSIS CODE (that worked successfully):
-```python
-{pandas_code}
-```
-
-ANALYSIS RESULT TYPE: {state['execution_result'].get('result_type')}
-RESULT PREVIEW:
-{state['execution_result']['result'][:500]}
+            system_message = """You are a data visualization expert. The previous visualization code FAILED with an error.
 
 FIX THE ERROR and generate corrected visualization code.
 
@@ -320,8 +424,8 @@ CRITICAL REQUIREMENTS:
 2. You MUST re-execute the EXACT working analysis code first
 3. DO NOT create intermediate DataFrames with new column names
 4. Use the actual result from re-executing the analysis
-5. Available in namespace: pd, np, df, plt, sns
-6. Create figure: fig, ax = plt.subplots(figsize=(12, 7))
+5. Available in namespace: pd, np, df, plt, sns, fig, ax
+6. Plot on the provided 'ax' (a blank 12x7 figure 'fig' is already created) - DO NOT call plt.subplots or plt.figure
 7. End with plt.tight_layout()
 
 CORRECT APPROACH:
@@ -329,35 +433,46 @@ CORRECT APPROACH:
 # Re-execute the working analysis (copy-paste from above)
 result_data = df['Complaint Type'].value_counts().head(10)
 
-# Plot directly - no intermediate variables with new names
-fig, ax = plt.subplots(figsize=(12, 7))
+# Plot directly on the provided ax - no intermediate variables with new names
 result_data.plot(kind='barh', ax=ax, color='steelblue')
 ax.set_xlabel('Count')
 ax.set_title('Top 10 Complaint Types')
 plt.tight_layout()
 ```
 
-Generate ONLY the CORRECTED visualization code:"""
-        else:
-            system_message = f"""You are a data visualization expert using matplotlib and seaborn.
+Generate ONLY the CORRECTED visualization code."""
+            user_message = f"""User Query: {state['query']}
 
-IMPORTANT: The following pandas code was already executed successfully:
+ORIGINAL ANALYSIS CODE (that worked successfully):
 ```python
 {pandas_code}
 ```
 
 ANALYSIS RESULT TYPE: {state['execution_result'].get('result_type')}
 RESULT PREVIEW:
-{state['execution_result']['result'][:500]}
+{state['execution_result']['result_preview']}
+
+PREVIOUS VISUALIZATION CODE THAT FAILED:
+```python
+{state['visualization_code']}
+```
+
+ERROR MESSAGE:
+{state['visualization_error']}
 
-Generate Python code to create a professional visualization of this result.
+Generate the corrected visualization."""
+        else:
+            system_message = """You are a data visualization expert using matplotlib and seaborn.
+
+The user provides pandas analysis code that was already executed successfully.
+Generate Python code to create a professional visualization of its result.
 
 CRITICAL REQUIREMENTS:
-1. DO NOT re-import anything (plt, sns, pd, np already available)
+1. DO NOT re-import anything (plt, sns, pd, np, fig, ax already available)
 2. DataFrame 'df' is available
-3. You MUST re-execute the EXACT analysis code above to get the data object
+3. You MUST re-execute the EXACT analysis code provided to get the data object
 4. DO NOT create DataFrames with new column names - use the actual data structure
-5. Create figure with: fig, ax = plt.subplots(figsize=(12, 7))
+5. Plot on the provided 'ax' (a blank 12x7 figure 'fig' is already created) - DO NOT call plt.subplots or plt.figure
 6. Choose appropriate chart type:
    - Series/value_counts: horizontal bar chart (barh)
    - Time series: line chart
@@ -376,22 +491,33 @@ EXAMPLE STRUCTURE:
 # Re-execute the exact analysis from above
 result_data = df['Complaint Type'].value_counts().head(10)
 
-# Create visualization directly from result_data
-fig, ax = plt.subplots(figsize=(12, 7))
+# Create visualization directly from result_data on the provided ax
 result_data.plot(kind='barh', ax=ax, color='steelblue')
 ax.set_xlabel('Count')
 ax.set_title('Top 10 Complaint Types')
 plt.tight_layout()
 ```
 
-Generate ONLY the visualization code:"""
+Generate ONLY the visualization code."""
+            user_message = f"""User Query: {state['query']}
+
+ANALYSIS CODE (already executed successfully):
+```python
+{pandas_code}
+```
+
+ANALYSIS RESULT TYPE: {state['execution_result'].get('result_type')}
+RESULT PREVIEW:
+{state['execution_result']['result_preview']}
+
+Create the visualization."""
         
         messages = [
             SystemMessage(content=system_message),
-            HumanMessage(content=f"User Query: {state['query']}\n\nCreate the visualization.")
+            HumanMessage(content=user_message)
         ]
         
-        response = self.llm.invoke(messages)
+        response = await self.llm.ainvoke(messages)
         
         # Extract code
         viz_code = response.content
@@ -401,19 +527,25 @@ Generate ONLY the visualization code:"""
             viz_code = viz_code.split("```")[1].split("```")[0]
         
         viz_code = viz_code.strip()
-        state["visualization_code"] = viz_code
         
         # Execute visualization code
-        result = self.tools.execute_visualization_code(viz_code)
+        result = await self.tools.aexecute_visualization_code(viz_code)
         
         if result["success"]:
-            state["visualization_image"] = result["image"]
-            state["visualization_error"] = ""
-        else:
-            state["visualization_image"] = ""
-            state["visualization_error"] = result["error"]
-        
-        return state
+            return {
+                "visualization_code": viz_code,
+                "visualization_image": result["image"],
+                "visualization_format": result["image_format"],
+                "visualization_error": "",
+                "analysis_trace": [f"generate_visualization: {result['image_format']}"]
+            }
+        return {
+            "visualization_code": viz_code,
+            "visualization_image": "",
+            "visualization_format": "",
+            "visualization_error": result["error"],
+            "analysis_trace": ["generate_visualization: failed"]
+        }
     
     def should_retry_visualization(self, state: AgentState) -> Literal["retry", "continue"]:
         """Decide whether to retry visualization generation"""
@@ -421,23 +553,17 @@ Generate ONLY the visualization code:"""
             return "retry"
         return "continue"
     
-    def retry_visualization(self, state: AgentState) -> AgentState:
+    async def retry_visualization(self, state: AgentState) -> dict:
         """Step 5b: Increment retry counter for visualization"""
-        state["visualization_retry_count"] += 1
-        return state
+        return {"visualization_retry_count": state["visualization_retry_count"] + 1}
     
-    def format_response(self, state: AgentState) -> AgentState:
-        """Step 6: Format the final response"""
-        
-        if state["error"]:
-            state["response"] = f"""I encountered an error while analyzing the data:
-
-{state['error']}
-
-Please try rephrasing your question or ask something else about the NYC 311 dataset."""
-            return state
-        
-        messages = [
+    async def visualization_done(self, state: AgentState) -> dict:
+        """Step 5c: Join point for the visualization branch"""
+        return {}
+    
+    def _response_messages(self, state: AgentState, visualization_created: bool) -> list:
+        """Build the response-formatting prompt shared by the draft and final steps"""
+        return [
             SystemMessage(content="""You are a helpful data analyst presenting findings to a user.
 
 Format the results in a clear, professional manner:
@@ -457,58 +583,245 @@ Do NOT:
 Analysis Results:
 {state['execution_result']['result']}
 
-Visualization Created: {state.get('needs_visualization', False) and not state.get('visualization_error')}
+Visualization Created: {visualization_created}
 
 Format this into a clear, helpful response:""")
         ]
+    
+    async def draft_response(self, state: AgentState) -> dict:
+        """Step 5 (parallel): Draft the response while the visualization is generated"""
         
-        response = self.llm.invoke(messages)
-        state["response"] = response.content
+        response = await self.llm.ainvoke(self._response_messages(state, visualization_created=True))
         
-        return state
+        return {"response_draft": response.content}
     
-    def process_query(self, query: str) -> dict:
-        """
-        Main entry point: Process a user query
+    async def format_response(self, state: AgentState) -> dict:
+        """Step 6: Format the final response"""
         
-        Args:
-            query: User's question about the data
-            
-        Returns:
-            Dict with 'response' and optional 'visualization'
-        """
-        initial_state = {
+        if state["error"]:
+            return {"response": f"""I encountered an error while analyzing the data:
+
+{state['error']}
+
+Please try rephrasing your question or ask something else about the NYC 311 dataset."""}
+        
+        # The draft assumed a chart would be shown; reuse it unless the chart failed
+        if state.get("response_draft") and not state.get("visualization_error"):
+            return {"response": state["response_draft"]}
+        
+        visualization_created = bool(state.get('needs_visualization', False) and not state.get('visualization_error'))
+        response = await self.llm.ainvoke(self._response_messages(state, visualization_created))
+        
+        return {"response": response.content}
+    
+    def _initial_state(self, query: str) -> AgentState:
+        """Fresh graph state for a query"""
+        return {
             "query": query,
-            "dataset_context": "",
             "analysis_plan": "",
             "pandas_code": "",
             "execution_result": {},
             "needs_visualization": False,
             "visualization_code": "",
             "visualization_image": "",
+            "visualization_format": "",
             "visualization_error": "",
             "visualization_retry_count": 0,
+            "response_draft": "",
             "response": "",
             "error": "",
-            "retry_count": 0
+            "retry_count": 0,
+            "analysis_trace": []
         }
+    
+    def _build_result(self, final_state: dict) -> dict:
+        """Shape the final graph state into the API result"""
+        return {
+            "response": final_state["response"],
+            "visualization": final_state.get("visualization_image") if final_state.get("visualization_image") else None,
+            "visualization_format": final_state.get("visualization_format") if final_state.get("visualization_image") else None,
+            "code_executed": final_state.get("pandas_code"),
+            "visualization_code": final_state.get("visualization_code") if final_state.get("visualization_image") else None,
+            "success": not bool(final_state.get("error"))
+        }
+    
+    def _error_result(self, error: Exception) -> dict:
+        """API result for an unexpected failure"""
+        return {
+            "response": f"An unexpected error occurred: {str(error)}",
+            "visualization": None,
+            "visualization_format": None,
+            "code_executed": None,
+            "visualization_code": None,
+            "success": False
+        }
+    
+    @staticmethod
+    def _normalize_query(query: str) -> str:
+        """Normalize a query so trivially different phrasings share a cache entry"""
+        return re.sub(r'\s+', ' ', query.lower().strip()).rstrip('?.! ')
+    
+    def _get_cached_result(self, query: str) -> Optional[dict]:
+        """Cached result for a query, marked most recently used"""
+        key = self._normalize_query(query)
+        if key not in self._result_cache:
+            return None
+        self._result_cache.move_to_end(key)
+        return dict(self._result_cache[key])
+    
+    def _cache_result(self, query: str, result: dict):
+        """Remember a successful result, evicting the least recently used entry"""
+        if not result.get("success"):
+            return
+        self._result_cache[self._normalize_query(query)] = dict(result)
+        if len(self._result_cache) > RESULT_CACHE_SIZE:
+            self._result_cache.popitem(last=False)
+    
+    def _counts_code(self, column: str) -> str:
+        """Analysis code for the value counts of a column, reusing precomputed counts"""
+        if column in PRECOMPUTED_COUNTS:
+            return f"# df['{column}'].value_counts(), precomputed at startup\nresult = {PRECOMPUTED_COUNTS[column]}"
+        return f"result = df['{column}'].value_counts()"
+    
+    def _top_n_template(self, match: re.Match) -> tuple[str, str, str]:
+        """'top N complaint types/boroughs/agencies' -> (column, analysis code, title)"""
+        n = int(match.group(1))
+        column = TEMPLATE_COLUMNS[match.group(2)]
+        return column, f"{self._counts_code(column)}.head({n})", f"Top {n} {match.group(2).title()}"
+    
+    def _count_by_template(self, match: re.Match) -> tuple[str, str, str]:
+        """'complaints by borough/agency/status' -> (column, analysis code, title)"""
+        column = TEMPLATE_COLUMNS[match.group(1)]
+        return column, f"{self._counts_code(column)}\nresult = result[result > 0]", f"Service Requests by {column}"
+    
+    async def _answer_from_template(self, query: str) -> Optional[dict]:
+        """
+        Answer templated queries directly with pandas
+        
+        Returns:
+            Result dict like process_query, or None if no template applies
+        """
+        normalized = self._normalize_query(query)
+        for pattern, handler in self._templates:
+            match = pattern.fullmatch(normalized)
+            if match:
+                column, code, title = handler(match)
+                break
+        else:
+            return None
+        
+        if column not in self.df.columns:
+            return None
+        
+        execution = await asyncio.to_thread(self.tools.execute_pandas_code, code)
+        if not execution["success"] or execution["result_data"].empty:
+            return None
+        counts = execution["result_data"]
+        
+        # Markdown answer with counts and share of all requests
+        total = len(self.df)
+        lines = [f"**{title}** (out of {total:,} service requests):", ""]
+        for rank, (value, count) in enumerate(counts.items(), start=1):
+            share = count / total * 100 if total else 0
+            lines.append(f"{rank}. **{value}**: {count:,} requests ({share:.1f}%)")
+        
+        viz_code = f"""{code}
+
+# Horizontal bar chart, largest at the top
+result.sort_values().plot(kind='barh', ax=ax, color='steelblue')
+ax.set_xlabel('Number of Service Requests')
+ax.set_ylabel('{column}')
+ax.set_title({title!r})
+ax.grid(axis='x', alpha=0.3)
+plt.tight_layout()"""
+        viz = await self.tools.aexecute_visualization_code(viz_code)
+        
+        return {
+            "response": "\n".join(lines),
+            "visualization": viz["image"] if viz["success"] else None,
+            "visualization_format": viz["image_format"] if viz["success"] else None,
+            "code_executed": code,
+            "visualization_code": viz_code if viz["success"] else None,
+            "success": True
+        }
+    
+    async def _fast_path(self, query: str) -> Optional[dict]:
+        """Answer from the result cache or a query template, skipping the LLM graph"""
+        cached = self._get_cached_result(query)
+        if cached is not None:
+            return cached
+        
+        result = await self._answer_from_template(query)
+        if result is not None:
+            self._cache_result(query, result)
+        return result
+    
+    async def process_query(self, query: str) -> dict:
+        """
+        Main entry point: Process a user query
+        
+        Args:
+            query: User's question about the data
+            
+        Returns:
+            Dict with 'response' and optional 'visualization' ('png' or 'svg' per 'visualization_format')
+        """
+        fast_result = await self._fast_path(query)
+        if fast_result is not None:
+            return fast_result
         
         try:
-            final_state = self.graph.invoke(initial_state)
+            final_state = await self.graph.ainvoke(self._initial_state(query))
+            result = self._build_result(final_state)
+            self._cache_result(query, result)
+            return result
             
-            return {
-                "response": final_state["response"],
-                "visualization": final_state.get("visualization_image") if final_state.get("visualization_image") else None,
-                "code_executed": final_state.get("pandas_code"),
-                "visualization_code": final_state.get("visualization_code") if final_state.get("visualization_image") else None,
-                "success": not bool(final_state.get("error"))
-            }
+        except Exception as e:
+            return self._error_result(e)
+    
+    async def stream_query(self, query: str) -> AsyncIterator[dict]:
+        """
+        Streaming entry point: Process a user query and yield progress events
+        
+        Args:
+            query: User's question about the data
+            
+        Yields:
+            {'event': 'token', 'node', 'token'} for each LLM token,
+            {'event': 'node', 'node', 'output'} when a step finishes,
+            and finally {'event': 'result', 'result'} with the same dict process_query returns
+        """
+        fast_result = await self._fast_path(query)
+        if fast_result is not None:
+            yield {"event": "result", "result": fast_result}
+            return
+        
+        try:
+            final_state = None
+            async for event in self.graph.astream_events(self._initial_state(query), version="v2"):
+                kind = event["event"]
+                node = event.get("metadata", {}).get("langgraph_node")
+                
+                if kind == "on_chat_model_stream":
+                    token = event["data"]["chunk"].content
+                    if token:
+                        yield {"event": "token", "node": node, "token": token}
+                
+                elif kind == "on_chain_end" and event["name"] == node:
+                    output = event["data"].get("output") or {}
+                    yield {
+                        "event": "node",
+                        "node": node,
+                        "output": {key: output[key] for key in STREAMED_FIELDS if key in output}
+                    }
+                
+                elif kind == "on_chain_end" and not event.get("parent_ids"):
+                    # The root graph run finishing carries the final state
+                    final_state = event["data"]["output"]
+            
+            result = self._build_result(final_state)
+            self._cache_result(query, result)
+            yield {"event": "result", "result": result}
             
         except Exception as e:
-            return {
-                "response": f"An unexpected error occurred: {str(e)}",
-                "visualization": None,
-                "code_executed": None,
-                "visualization_code": None,
-                "success": False
-            }
\ No newline at end of file
+            yield {"event": "result", "result": self._error_result(e)}
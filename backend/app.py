@@ -3,14 +3,19 @@ FastAPI server for NYC 311 Analytics Agent
 """
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
 import os
 from dotenv import load_dotenv
-from agent import NYC311AnalyticsAgent
+from agent import NYC311AnalyticsAgent, close_http_clients
 import traceback
 import logging
+import json
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -33,6 +38,27 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Columns the agent actually analyzes; everything else in the export is skipped at parse time
+ESSENTIAL_COLUMNS = [
+    'Unique Key', 'Created Date', 'Closed Date', 'Agency', 'Agency Name',
+    'Complaint Type', 'Descriptor', 'Location Type', 'Incident Zip', 'City',
+    'Status', 'Resolution Description', 'Borough', 'Latitude', 'Longitude'
+]
+
+# Low-cardinality text columns loaded as pandas 'category' (int codes instead of Python str objects)
+CATEGORICAL_COLUMNS = [
+    'Complaint Type', 'Borough', 'Agency', 'Agency Name', 'Status',
+    'Descriptor', 'Location Type', 'City', 'Incident Zip'
+]
+
+# Timestamp format of the 311 export's date columns
+DATE_FORMAT = '%m/%d/%Y %I:%M:%S %p'
+
+# Parquet metadata key recording how a snapshot was parsed. Bump SNAPSHOT_VERSION
+# whenever read_csv_dataset changes the resulting dtypes.
+SNAPSHOT_VERSION = 3
+SNAPSHOT_SCHEMA_KEY = b'nyc311_schema'
+
 # Global variables
 agent = None
 df = None
@@ -44,10 +70,100 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     response: str
     visualization: Optional[str] = None
+    visualization_format: Optional[str] = None  # 'png' or 'svg'
     success: bool = True
     code_executed: Optional[str] = None
     visualization_code: Optional[str] = None
 
+def read_csv_dataset(csv_path: str) -> pd.DataFrame:
+    """Parse the raw 311 CSV export"""
+    # Only request columns/dtypes this export actually has
+    header = pd.read_csv(csv_path, nrows=0).columns
+    usecols = [col for col in ESSENTIAL_COLUMNS if col in header]
+    date_columns = [col for col in ['Created Date', 'Closed Date'] if col in header]
+    
+    # Categorical columns are declared as dictionary-encoded strings up front; pandas'
+    # dtype= is applied after Arrow's type inference, which turns zips like '07030' into 7030
+    column_types = {
+        col: pa.dictionary(pa.int32(), pa.string())
+        for col in CATEGORICAL_COLUMNS if col in header
+    }
+    
+    # Load with optimizations: multi-threaded Arrow parser, pruned columns
+    table = pa_csv.read_csv(
+        csv_path,
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=usecols,
+            column_types=column_types,
+            strings_can_be_null=True  # Empty cells are missing values, not ''
+        )
+    )
+    df = table.to_pandas()  # Dictionary columns arrive as 'category', no object round-trip
+    
+    # Arrow keeps dictionary values in first-appearance order; sort them so sorting and
+    # groupby on these columns stay alphabetical
+    for col in column_types:
+        df[col] = df[col].cat.reorder_categories(sorted(df[col].cat.categories))
+    
+    for col in date_columns:
+        try:
+            df[col] = pd.to_datetime(df[col], format=DATE_FORMAT)
+        except (ValueError, TypeError):
+            # Export in a different timestamp layout
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+    return df
+
+def snapshot_schema() -> bytes:
+    """Description of the parsing setup a snapshot must match to be reused"""
+    return json.dumps({
+        'version': SNAPSHOT_VERSION,
+        'columns': ESSENTIAL_COLUMNS,
+        'categorical': CATEGORICAL_COLUMNS,
+        'date_format': DATE_FORMAT
+    }).encode()
+
+def write_parquet_snapshot(df: pd.DataFrame, parquet_path: str):
+    """Save the parsed dataset so later starts can skip CSV parsing"""
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            SNAPSHOT_SCHEMA_KEY: snapshot_schema()
+        })
+        pq.write_table(table, parquet_path, compression='snappy', row_group_size=256_000)
+        logger.info(f"✓ Parquet snapshot written to: {parquet_path}")
+    except Exception as e:
+        # The snapshot is only a cache; startup continues without it
+        logger.warning(f"Could not write Parquet snapshot: {e}")
+
+def read_parquet_snapshot(parquet_path: str) -> Optional[pd.DataFrame]:
+    """
+    Load a Parquet snapshot, or None if it was written with a different parsing setup
+    
+    Checks the stored schema stamp, then that categorical and date columns came back
+    with the dtypes a fresh CSV parse produces, so every boot sees the same dataset.
+    """
+    try:
+        metadata = pq.read_schema(parquet_path).metadata or {}
+        if metadata.get(SNAPSHOT_SCHEMA_KEY) != snapshot_schema():
+            logger.warning(f"Parquet snapshot {parquet_path} was written with a different schema; ignoring it")
+            return None
+        
+        df = pd.read_parquet(parquet_path, engine='pyarrow')
+    except Exception as e:
+        logger.warning(f"Could not read Parquet snapshot: {e}")
+        return None
+    
+    mismatched = [
+        col for col in df.columns
+        if (col in CATEGORICAL_COLUMNS and not isinstance(df[col].dtype, pd.CategoricalDtype))
+        or (col in ('Created Date', 'Closed Date') and not pd.api.types.is_datetime64_any_dtype(df[col]))
+    ]
+    if mismatched:
+        logger.warning(f"Parquet snapshot has unexpected dtypes for {mismatched}; ignoring it")
+        return None
+    return df
+
 @app.on_event("startup")
 async def startup_event():
     """Load dataset and initialize agent on startup"""
@@ -55,23 +171,30 @@ async def startup_event():
     
     try:
         csv_path = "311_Service_Requests_from_2010_to_Present.csv"
+        parquet_path = csv_path.replace('.csv', '.parquet')
         
-        if not os.path.exists(csv_path):
+        # A Parquet snapshot is only trusted if it is at least as new as the CSV
+        has_csv = os.path.exists(csv_path)
+        has_snapshot = os.path.exists(parquet_path) and (
+            not has_csv or os.path.getmtime(parquet_path) >= os.path.getmtime(csv_path)
+        )
+        
+        df = None
+        if has_snapshot:
+            logger.info(f"Loading NYC 311 dataset from snapshot: {parquet_path}")
+            df = read_parquet_snapshot(parquet_path)
+        
+        if df is None and not has_csv:
             logger.error(f"CSV file not found at: {csv_path}")
             logger.info("Please download the NYC 311 dataset and place it in the backend directory")
             logger.info("Download from: https://data.cityofnewyork.us/Social-Services/311-Service-Requests-from-2010-to-Present/erm2-nwe9")
             return
         
-        logger.info("Loading NYC 311 dataset...")
-        logger.info("This may take a few minutes for large files...")
-        
-        # Load with optimizations
-        df = pd.read_csv(
-            csv_path,
-            low_memory=False,
-            parse_dates=['Created Date', 'Closed Date'],
-            nrows=None  # Load all rows; change to 100000 for testing
-        )
+        if df is None:
+            logger.info("Loading NYC 311 dataset...")
+            logger.info("This may take a few minutes for large files...")
+            df = read_csv_dataset(csv_path)
+            write_parquet_snapshot(df, parquet_path)
         
         logger.info(f"✓ Dataset loaded successfully!")
         logger.info(f"  - Records: {len(df):,}")
@@ -81,6 +204,8 @@ async def startup_event():
         # Initialize agent
         logger.info("Initializing AI agent...")
         agent = NYC311AnalyticsAgent(df)
+        # Start chart render workers now so no request pays for their startup
+        agent.tools.wait_for_viz_workers()
         dataset_loaded = True
         logger.info("✓ Agent initialized successfully!")
         logger.info("Server ready to accept requests!")
@@ -89,6 +214,13 @@ async def startup_event():
         logger.error(f"Error during startup: {e}")
         traceback.print_exc()
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release shared resources"""
+    if agent is not None:
+        agent.tools.close()
+    await close_http_clients()
+
 @app.get("/")
 async def root():
     """Root endpoint"""
@@ -99,6 +231,7 @@ async def root():
         "endpoints": {
             "health": "/health",
             "chat": "/api/chat (POST)",
+            "chat_stream": "/api/chat/stream (POST, Server-Sent Events)",
             "docs": "/docs"
         }
     }
@@ -134,13 +267,14 @@ async def chat(request: ChatRequest):
         logger.info(f"Processing query: {request.message[:100]}...")
         
         # Process query through agent
-        result = agent.process_query(request.message)
+        result = await agent.process_query(request.message)
         
         logger.info(f"Query processed successfully. Visualization: {bool(result.get('visualization'))}")
         
         return ChatResponse(
             response=result["response"],
             visualization=result.get("visualization") or None,
+            visualization_format=result.get("visualization_format") or None,
             success=result.get("success", True),
             code_executed=result.get("code_executed") or None,
             visualization_code=result.get("visualization_code") or None
@@ -155,6 +289,39 @@ async def chat(request: ChatRequest):
             detail=f"Error processing query: {str(e)}"
         )
 
+@app.post("/api/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Streaming chat endpoint: emits agent progress as Server-Sent Events
+    
+    Each event is a JSON object: 'token' events carry LLM output as it is generated,
+    'node' events mark finished steps, and the last 'result' event has the ChatResponse fields.
+    """
+    global agent, df
+    
+    if not dataset_loaded or agent is None or df is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Dataset not loaded. Please ensure the CSV file is in the backend directory and restart the server."
+        )
+    
+    if not request.message.strip():
+        raise HTTPException(status_code=400, detail="Message cannot be empty")
+    
+    logger.info(f"Streaming query: {request.message[:100]}...")
+    
+    async def event_stream():
+        async for event in agent.stream_query(request.message):
+            if event["event"] == "result":
+                logger.info(f"Query streamed successfully. Visualization: {bool(event['result'].get('visualization'))}")
+            yield f"data: {json.dumps(event, default=str)}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 if __name__ == "__main__":
     import uvicorn
     
@@ -0,0 +1,113 @@
+"""
+Numba-compiled numeric helpers exposed to generated analysis code as `jit`
+"""
+import numpy as np
+import pandas as pd
+import numba
+from numba import njit, prange
+
+# Integer value numpy uses for NaT in datetime64 arrays viewed as int64
+NAT_NS = np.iinfo(np.int64).min
+NS_PER_HOUR = 3_600_000_000_000
+
+@njit(cache=True, parallel=True)
+def _resolution_hours(created_ns, closed_ns):
+    out = np.empty(created_ns.shape[0], dtype=np.float64)
+    for i in prange(created_ns.shape[0]):
+        if created_ns[i] == NAT_NS or closed_ns[i] == NAT_NS:
+            out[i] = np.nan
+        else:
+            out[i] = (closed_ns[i] - created_ns[i]) / NS_PER_HOUR
+    return out
+
+@njit(cache=True, parallel=True)
+def _groupby_mean_by_code(codes, values, n_groups, n_chunks):
+    # Each chunk accumulates into its own row, so the parallel loop never races
+    sums = np.zeros((n_chunks, n_groups), dtype=np.float64)
+    counts = np.zeros((n_chunks, n_groups), dtype=np.int64)
+    chunk_size = (codes.shape[0] + n_chunks - 1) // n_chunks
+    for chunk in prange(n_chunks):
+        start = chunk * chunk_size
+        stop = min(start + chunk_size, codes.shape[0])
+        for i in range(start, stop):
+            code = codes[i]
+            value = values[i]
+            # Code -1 marks a missing category
+            if code >= 0 and not np.isnan(value):
+                sums[chunk, code] += value
+                counts[chunk, code] += 1
+
+    out = np.empty(n_groups, dtype=np.float64)
+    for group in range(n_groups):
+        total = 0.0
+        count = 0
+        for chunk in range(n_chunks):
+            total += sums[chunk, group]
+            count += counts[chunk, group]
+        out[group] = total / count if count > 0 else np.nan
+    return out
+
+def _as_int64_ns(values) -> np.ndarray:
+    """View datetime64 data (Series, arrays or already-int64 ns) as int64 nanoseconds"""
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        values = values.astype('datetime64[ns]', copy=False)
+    return values.view('i8')
+
+def resolution_hours(created, closed) -> np.ndarray:
+    """
+    Hours between creation and closure for each request
+
+    Args:
+        created: 'Created Date' values (datetime64 or int64 nanoseconds)
+        closed: 'Closed Date' values (datetime64 or int64 nanoseconds)
+
+    Returns:
+        float64 array, NaN where either date is missing
+    """
+    created_ns, closed_ns = _as_int64_ns(created), _as_int64_ns(closed)
+    # The kernel does no bounds checking, so bad input must not reach it
+    if created_ns.ndim != 1 or created_ns.shape != closed_ns.shape:
+        raise ValueError(f"created and closed must be 1-D and the same length, got shapes {created_ns.shape} and {closed_ns.shape}")
+    return _resolution_hours(created_ns, closed_ns)
+
+def groupby_mean_by_code(codes, values, n_groups: int) -> np.ndarray:
+    """
+    Mean of values per integer group code, ignoring NaN values and code -1
+
+    Args:
+        codes: Integer group codes, e.g. df['Borough'].cat.codes.values
+        values: Numeric values aligned with codes
+        n_groups: Number of groups, e.g. len(df['Borough'].cat.categories)
+
+    Returns:
+        float64 array of length n_groups, NaN for empty groups
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    # The kernel does no bounds checking, so bad input must not reach it
+    if codes.ndim != 1 or codes.shape != values.shape:
+        raise ValueError(f"codes and values must be 1-D and the same length, got shapes {codes.shape} and {values.shape}")
+    if n_groups < 0:
+        raise ValueError(f"n_groups must be non-negative, got {n_groups}")
+    if codes.size and codes.max() >= n_groups:
+        raise ValueError(f"codes go up to {codes.max()} but n_groups is {n_groups}")
+    return _groupby_mean_by_code(codes, values, n_groups, numba.get_num_threads())
+
+def mean_resolution_hours_by(df: pd.DataFrame, column: str) -> pd.Series:
+    """
+    Mean resolution time in hours per value of a categorical column
+
+    Args:
+        df: NYC 311 DataFrame with 'Created Date' and 'Closed Date'
+        column: Name of a 'category' dtype column, e.g. 'Borough'
+
+    Returns:
+        Series indexed by category, sorted descending
+    """
+    categorical = df[column].astype('category')
+    hours = resolution_hours(df['Created Date'].values, df['Closed Date'].values)
+    means = groupby_mean_by_code(
+        categorical.cat.codes.values, hours, len(categorical.cat.categories)
+    )
+    return pd.Series(means, index=categorical.cat.categories, name='Resolution Hours').dropna().sort_values(ascending=False)
@@ -3,8 +3,8 @@ Data analysis tools for the LangGraph agent
 """
 import pandas as pd
 import numpy as np
-from typing import Dict, Any, Optional
-import traceback
+from typing import Dict, Any, Optional, Tuple
+import logging
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
@@ -12,16 +12,419 @@ import seaborn as sns
 import base64
 from io import BytesIO
 import warnings
+import re
+import ast
+import functools
+import asyncio
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from types import CodeType
+import pyarrow as pa
+import pyarrow.feather as feather
+import jit_helpers
+
+logger = logging.getLogger(__name__)
 
 # Suppress matplotlib warnings
 warnings.filterwarnings('ignore', category=UserWarning)
 
-class DataAnalysisTools:
-    """Tools for analyzing the NYC 311 dataset"""
+# Statements that write into df's arrays in place; only code matching these needs a
+# private deep copy. Plain column assignment (df['col'] = ...) replaces the column on
+# the shallow copy and is deliberately excluded.
+_DF_MUTATION_PATTERN = re.compile(
+    r"\bdf(?!\s*\[\s*(['\"])[^'\"]*\1\s*\]\s*=(?!=))"
+    r"(?:\.(?:loc|iloc|at|iat))?\s*\[.*\]\s*(?:[-+*/%|&^]|//|\*\*|<<|>>)?=(?!=)"
+    r"|inplace\s*=\s*True"
+)
+
+# Modules generated code may import (everything it needs is already in the namespace)
+ALLOWED_IMPORTS = {
+    'pandas', 'numpy', 'matplotlib', 'seaborn', 'math', 'statistics',
+    'datetime', 're', 'collections', 'itertools'
+}
+
+# Builtins that would let generated code escape the namespace or touch the filesystem
+BLOCKED_NAMES = {
+    '__import__', 'eval', 'exec', 'compile', 'open', 'input', 'breakpoint',
+    'globals', 'locals', 'vars', 'getattr', 'setattr', 'delattr', 'exit', 'quit'
+}
+
+# Modules that allowed libraries re-export as attributes (e.g. pd.io.common.os);
+# reaching any of them by attribute is rejected
+BLOCKED_ATTRIBUTES = {
+    'os', 'sys', 'subprocess', 'builtins', 'importlib', 'shutil', 'ctypes',
+    'socket', 'signal', 'pickle', 'marshal', 'multiprocessing', 'threading', 'pathlib'
+}
+
+class _CodeValidator(ast.NodeVisitor):
+    """
+    Reject generated code that imports arbitrary modules or reaches for interpreter internals
+    
+    This catches the LLM wandering off (shell calls, file access, introspection); it is
+    a static check, not a security boundary against deliberately hostile code.
+    """
+    
+    def visit_Import(self, node: ast.Import):
+        for alias in node.names:
+            self._check_module(alias.name)
+    
+    def visit_ImportFrom(self, node: ast.ImportFrom):
+        if node.level or not node.module:
+            raise ValueError("Relative imports are not allowed")
+        self._check_module(node.module)
+    
+    def visit_Attribute(self, node: ast.Attribute):
+        if node.attr.startswith('__') and node.attr.endswith('__'):
+            raise ValueError(f"Access to attribute '{node.attr}' is not allowed")
+        if node.attr in BLOCKED_ATTRIBUTES:
+            raise ValueError(f"Access to module '{node.attr}' is not allowed")
+        self.generic_visit(node)
+    
+    def visit_Name(self, node: ast.Name):
+        if node.id in BLOCKED_NAMES or (node.id.startswith('__') and node.id.endswith('__')):
+            raise ValueError(f"Use of '{node.id}' is not allowed")
+    
+    def _check_module(self, module: str):
+        if module.split('.')[0] not in ALLOWED_IMPORTS:
+            raise ValueError(f"Import of '{module}' is not allowed; available modules: {', '.join(sorted(ALLOWED_IMPORTS))}")
+
+@functools.lru_cache(maxsize=256)
+def _compile_code(code: str) -> CodeType:
+    """Validate and compile generated code, cached by source so repeat queries skip parsing"""
+    tree = ast.parse(code, filename='<agent-gen>', mode='exec')
+    _CodeValidator().visit(tree)
+    return compile(tree, '<agent-gen>', 'exec')
+
+def _summarize_error(error: Exception, code: str) -> str:
+    """
+    One-line error for the LLM: the exception plus the generated line that raised it
+    
+    The full traceback (mostly pandas internals) is logged server-side instead of
+    being sent back in the retry prompt.
+    """
+    message = f"{type(error).__name__}: {error}"
+    
+    lineno = error.lineno if isinstance(error, SyntaxError) and error.filename == '<agent-gen>' else None
+    tb = error.__traceback__
+    while tb is not None:
+        if tb.tb_frame.f_code.co_filename == '<agent-gen>':
+            lineno = tb.tb_lineno
+        tb = tb.tb_next
     
-    def __init__(self, df: pd.DataFrame):
+    lines = code.splitlines()
+    if lineno and 0 < lineno <= len(lines):
+        message += f" (line {lineno}: {lines[lineno - 1].strip()})"
+    return message
+
+# Bounds on how much of a result is formatted for prompts
+RESULT_MAX_ROWS = 50
+RESULT_MAX_COLS = 20
+RESULT_MAX_COLWIDTH = 40
+RESULT_PREVIEW_CHARS = 500
+
+# Charts with fewer drawn elements than this are sent as SVG instead of PNG
+SVG_ELEMENT_LIMIT = 500
+
+def _count_drawn_elements(fig) -> float:
+    """Rough count of vector elements in a figure; raster images always force PNG"""
+    total = 0
+    for ax in fig.axes:
+        if ax.images:
+            return float('inf')
+        total += len(ax.patches) + len(ax.lines)
+        for collection in ax.collections:
+            # Scatter plots share one path across many offsets; meshes have a path per cell
+            total += max(len(collection.get_paths()), len(collection.get_offsets()))
+    return total
+
+# Chart rendering worker processes (see DataAnalysisTools._start_viz_pool)
+DEFAULT_VIZ_WORKERS = 2
+VIZ_WORKER_START_TIMEOUT = 120  # seconds
+
+# Per-worker state, set by _viz_init
+_WORKER_RENDERER = None
+_WORKER_READY = None
+
+def _arrow_column(series: pd.Series) -> pa.Array:
+    """
+    Arrow array for the shared dataset file
+    
+    NaN and NaT stay plain values rather than Arrow nulls, so workers can convert
+    float and datetime columns to pandas without copying them.
+    """
+    values = series.values
+    if isinstance(values, np.ndarray) and values.dtype.kind == 'f':
+        return pa.array(values)
+    if isinstance(values, np.ndarray) and values.dtype.kind == 'M':
+        unit = np.datetime_data(values.dtype)[0]
+        return pa.array(values.view('i8')).view(pa.timestamp(unit))
+    return pa.array(series, from_pandas=True)
+
+def _viz_init(df_path: str, complaint_counts: Optional[pd.Series],
+              borough_counts: Optional[pd.Series], ready):
+    """Map the shared dataset file and set up the renderer, once per worker"""
+    global _WORKER_RENDERER, _WORKER_READY
+    # Single-chunk, null-free columns convert zero-copy onto the memory map, so the
+    # dataset pages are shared through the OS page cache; only categorical codes of
+    # columns with missing values are materialized per worker. Text stays Arrow-backed:
+    # pandas 3's default str dtype already is, older pandas would build a Python str
+    # per value, so text is mapped to string[pyarrow] there.
+    types_mapper = None
+    if not pd.get_option('future.infer_string'):
+        types_mapper = {pa.string(): pd.StringDtype('pyarrow'), pa.large_string(): pd.StringDtype('pyarrow')}.get
+    table = feather.read_table(df_path, memory_map=True)
+    df = table.to_pandas(split_blocks=True, types_mapper=types_mapper)
+    _WORKER_RENDERER = _FigureRenderer(df, complaint_counts, borough_counts)
+    _WORKER_READY = ready
+    # Draw once so font loading and renderer setup happen before the first request
+    _WORKER_RENDERER._fig.canvas.draw()
+
+def _viz_worker_ready():
+    """Warm-up task: holds its worker until every worker has finished _viz_init"""
+    _WORKER_READY.wait(timeout=VIZ_WORKER_START_TIMEOUT)
+
+def _render_visualization(viz_code: str) -> Dict[str, Any]:
+    """Render visualization code in a worker process"""
+    return _WORKER_RENDERER.execute_visualization_code(viz_code)
+
+class _FigureRenderer:
+    """Runs visualization code against a read-only DataFrame on one pooled figure"""
+    
+    def __init__(self, df: pd.DataFrame, complaint_counts: Optional[pd.Series] = None,
+                 borough_counts: Optional[pd.Series] = None):
         self.df = df
+        self._make_read_only()
+        
+        # Full value counts are reused by the dataset context and exposed to generated code
+        self.complaint_counts = complaint_counts
+        self.borough_counts = borough_counts
+        
+        # One figure is reused for every chart to skip figure/font setup per request
+        self._fig, self._ax = plt.subplots(figsize=(12, 7))
+    
+    # Dates as int64 nanoseconds so generated code can do plain integer arithmetic;
+    # built on first use since non-ns dates need a converted copy
+    @functools.cached_property
+    def created_ns(self) -> Optional[np.ndarray]:
+        return self._datetime_ns('Created Date')
+    
+    @functools.cached_property
+    def closed_ns(self) -> Optional[np.ndarray]:
+        return self._datetime_ns('Closed Date')
+    
+    def _make_read_only(self):
+        """Lock the underlying numpy arrays so generated code cannot modify the shared data"""
+        for block in self.df._mgr.blocks:
+            values = block.values
+            # Extension arrays keep their data in private numpy arrays: Categorical codes and
+            # tz-aware datetimes in _ndarray, nullable numbers in _data/_mask
+            for array in (values, getattr(values, '_ndarray', None),
+                          getattr(values, '_data', None), getattr(values, '_mask', None)):
+                if isinstance(array, np.ndarray):
+                    array.flags.writeable = False
+    
+    def _datetime_ns(self, column: str) -> Optional[np.ndarray]:
+        """Read-only int64 nanosecond view of a datetime column (zero-copy when already ns), or None"""
+        if column not in self.df.columns or not pd.api.types.is_datetime64_any_dtype(self.df[column]):
+            return None
+        values = self.df[column].values.astype('datetime64[ns]', copy=False).view('i8')
+        values.flags.writeable = False
+        return values
+    
+    def _namespace_df(self, code: str) -> pd.DataFrame:
+        """
+        DataFrame handed to generated code
+        
+        A shallow copy shares the locked arrays, so adding/dropping columns stays local
+        and in-place writes raise. Only code that writes into df's arrays gets a deep copy.
+        """
+        if _DF_MUTATION_PATTERN.search(code):
+            return self.df.copy()
+        return self.df.copy(deep=False)
+    
+    def _precomputed(self, code: str) -> Dict[str, Any]:
+        """Cached aggregates the code refers to (counts are copied; date arrays are read-only)"""
+        precomputed = {}
+        if '_top_complaints' in code:
+            precomputed['_top_complaints'] = self.complaint_counts.copy() if self.complaint_counts is not None else None
+        if '_top_boroughs' in code:
+            precomputed['_top_boroughs'] = self.borough_counts.copy() if self.borough_counts is not None else None
+        if 'created_ns' in code:
+            precomputed['created_ns'] = self.created_ns
+        if 'closed_ns' in code:
+            precomputed['closed_ns'] = self.closed_ns
+        return precomputed
+    
+    def _encode_figure(self, fig) -> Tuple[str, str]:
+        """
+        Render a figure to base64, as SVG for simple charts and fast-compressed PNG otherwise
+        
+        Returns:
+            Tuple of (base64 image, 'svg' or 'png')
+        """
+        buffer = BytesIO()
+        if _count_drawn_elements(fig) < SVG_ELEMENT_LIMIT:
+            # Keep text as text so the SVG stays small and crisp
+            with plt.rc_context({'svg.fonttype': 'none'}):
+                fig.savefig(buffer, format='svg', bbox_inches='tight')
+            image_format = 'svg'
+        else:
+            # zlib level 1 is several times faster than the default with slightly larger output
+            fig.savefig(buffer, format='png', dpi=90, bbox_inches='tight',
+                        pil_kwargs={'optimize': False, 'compress_level': 1})
+            image_format = 'png'
+        return base64.b64encode(buffer.getvalue()).decode(), image_format
+    
+    def _reset_figure(self):
+        """Return the pooled figure to a blank 12x7 single-axes figure and make it current"""
+        # Drop any figures generated code created on its own
+        for num in plt.get_fignums():
+            if num != self._fig.number:
+                plt.close(num)
+        
+        if not plt.fignum_exists(self._fig.number):
+            # Generated code closed the pooled figure
+            self._fig, self._ax = plt.subplots(figsize=(12, 7))
+        elif self._fig.axes != [self._ax] or self._fig.texts or self._fig.legends:
+            # Colorbars, twin axes or figure-level text need a full clear
+            self._fig.clear()
+            self._ax = self._fig.add_subplot()
+        else:
+            self._ax.clear()
+        
+        self._fig.set_size_inches(12, 7)
+        plt.figure(self._fig.number)
+    
+    def execute_visualization_code(self, viz_code: str) -> Dict[str, Any]:
+        """
+        Execute matplotlib/seaborn visualization code and return base64 image or error
+        
+        Args:
+            viz_code: Python code that creates a matplotlib/seaborn visualization
+            
+        Returns:
+            Dict with 'success', 'image' (base64), 'image_format' ('png' or 'svg'), and 'error'
+        """
+        try:
+            self._reset_figure()
+            
+            # Create safe execution namespace with visualization libraries
+            namespace = {
+                'pd': pd,
+                'np': np,
+                'df': self._namespace_df(viz_code),
+                'plt': plt,
+                'sns': sns,
+                'jit': jit_helpers,
+                **self._precomputed(viz_code),
+                'fig': self._fig,
+                'ax': self._ax
+            }
+            
+            # Execute visualization code
+            exec(_compile_code(viz_code), namespace)
+            
+            # Convert to base64
+            image_base64, image_format = self._encode_figure(plt.gcf())
+            self._reset_figure()
+            
+            return {
+                'success': True,
+                'image': image_base64,
+                'image_format': image_format,
+                'error': None
+            }
+            
+        except Exception as e:
+            logger.exception("Generated visualization code failed")
+            error_msg = _summarize_error(e, viz_code)
+            self._reset_figure()
+            
+            return {
+                'success': False,
+                'image': None,
+                'image_format': None,
+                'error': error_msg
+            }
+    
+
+class DataAnalysisTools(_FigureRenderer):
+    """Tools for analyzing the NYC 311 dataset"""
+    
+    def __init__(self, df: pd.DataFrame, viz_workers: int = DEFAULT_VIZ_WORKERS):
+        """
+        Args:
+            df: NYC 311 DataFrame
+            viz_workers: Processes for rendering visualizations (0 renders in this process)
+        """
+        super().__init__(
+            df,
+            complaint_counts=df['Complaint Type'].value_counts() if 'Complaint Type' in df.columns else None,
+            borough_counts=df['Borough'].value_counts() if 'Borough' in df.columns else None
+        )
         self.dataset_info = self._generate_dataset_info()
+        
+        # Matplotlib rendering holds the GIL, so charts render in worker processes.
+        # Each worker is a full interpreter with matplotlib loaded, hence the small default.
+        self._viz_workers = max(0, min(viz_workers, os.cpu_count() or 1))
+        self._viz_pool = None
+        self._viz_warmup = []
+        self._df_path = None
+        if self._viz_workers:
+            try:
+                self._start_viz_pool()
+            except Exception:
+                logger.exception("Could not start visualization workers; rendering in-process")
+                self.close()
+    
+    def _start_viz_pool(self):
+        """Write the dataset to an Arrow IPC file once and start warming up the render workers"""
+        if self._df_path is None:
+            fd, self._df_path = tempfile.mkstemp(prefix='nyc311_', suffix='.arrow')
+            os.close(fd)
+            df = self.df if isinstance(self.df.index, pd.RangeIndex) else self.df.reset_index()
+            table = pa.Table.from_arrays([_arrow_column(df[col]) for col in df.columns], names=list(df.columns))
+            # Uncompressed and in one chunk so workers can use the columns in place
+            feather.write_feather(table, self._df_path, compression='uncompressed', chunksize=max(len(df), 1))
+        
+        # spawn: workers must not inherit the server's threads or event loop
+        context = multiprocessing.get_context('spawn')
+        ready = context.Barrier(self._viz_workers)
+        self._viz_pool = ProcessPoolExecutor(
+            max_workers=self._viz_workers,
+            mp_context=context,
+            initializer=_viz_init,
+            initargs=(self._df_path, self.complaint_counts, self.borough_counts, ready)
+        )
+        # Workers spawn lazily; one barrier-held task per worker starts all of them now
+        self._viz_warmup = [self._viz_pool.submit(_viz_worker_ready) for _ in range(self._viz_workers)]
+    
+    def wait_for_viz_workers(self):
+        """Block until every render worker has loaded the dataset; fall back to in-process rendering if they cannot"""
+        if self._viz_pool is None:
+            return
+        try:
+            for future in self._viz_warmup:
+                future.result(timeout=VIZ_WORKER_START_TIMEOUT)
+        except Exception:
+            logger.exception("Visualization workers failed to start; rendering in-process")
+            self.close()
+    
+    def close(self):
+        """Shut down the render workers and remove the shared dataset file"""
+        if self._viz_pool is not None:
+            self._viz_pool.shutdown(wait=False, cancel_futures=True)
+            self._viz_pool = None
+        self._viz_warmup = []
+        if self._df_path is not None:
+            try:
+                os.remove(self._df_path)
+            except OSError:
+                pass
+            self._df_path = None
     
     def _generate_dataset_info(self) -> str:
         """Generate comprehensive dataset information for AI context"""
@@ -31,10 +434,10 @@ class DataAnalysisTools:
         info_parts.append(f"Dataset Shape: {self.df.shape[0]:,} rows × {self.df.shape[1]} columns")
         info_parts.append(f"\nColumn Names and Types:")
         
-        for col in self.df.columns[:30]:  # First 30 columns
-            dtype = str(self.df[col].dtype)
-            non_null = self.df[col].count()
-            null_pct = (1 - non_null/len(self.df)) * 100
+        # One vectorized pass over the first 30 columns instead of a count() per column
+        columns = self.df.iloc[:, :30]
+        null_pcts = columns.isna().mean().to_numpy() * 100
+        for col, dtype, null_pct in zip(columns.columns, columns.dtypes, null_pcts):
             info_parts.append(f"  - {col}: {dtype} ({null_pct:.1f}% null)")
         
         # Sample data
@@ -42,15 +445,32 @@ class DataAnalysisTools:
         info_parts.append(self.df.head(5).to_string())
         
         # Key statistics for important columns
-        if 'Complaint Type' in self.df.columns:
-            top_complaints = self.df['Complaint Type'].value_counts().head(10)
+        if self.complaint_counts is not None:
             info_parts.append(f"\nTop 10 Complaint Types:")
-            info_parts.append(top_complaints.to_string())
+            info_parts.append(self.complaint_counts.head(10).to_string())
         
-        if 'Borough' in self.df.columns:
-            borough_counts = self.df['Borough'].value_counts()
+        if self.borough_counts is not None:
             info_parts.append(f"\nComplaints by Borough:")
-            info_parts.append(borough_counts.to_string())
+            info_parts.append(self.borough_counts.to_string())
+        
+        # Precomputed objects generated code can use instead of recomputing
+        precomputed = []
+        if self.complaint_counts is not None:
+            precomputed.append("  - _top_complaints: df['Complaint Type'].value_counts() (all types, sorted descending)")
+        if self.borough_counts is not None:
+            precomputed.append("  - _top_boroughs: df['Borough'].value_counts() (sorted descending)")
+        if self.created_ns is not None:
+            precomputed.append("  - created_ns: df['Created Date'] as int64 nanoseconds (numpy array, row-aligned with df)")
+        if self.closed_ns is not None:
+            precomputed.append("  - closed_ns: df['Closed Date'] as int64 nanoseconds (numpy array, row-aligned with df)")
+        if self.created_ns is not None and self.closed_ns is not None:
+            precomputed.append("    Missing dates are jit.NAT_NS; response hours: "
+                               "valid = (created_ns != jit.NAT_NS) & (closed_ns != jit.NAT_NS); "
+                               "hours = (closed_ns[valid] - created_ns[valid]) / 3_600_000_000_000 "
+                               "(or jit.resolution_hours(created_ns, closed_ns), NaN where missing)")
+        if precomputed:
+            info_parts.append(f"\nPrecomputed objects available during code execution:")
+            info_parts.extend(precomputed)
         
         return "\n".join(info_parts)
     
@@ -66,25 +486,28 @@ class DataAnalysisTools:
             code: Python/pandas code to execute
             
         Returns:
-            Dict with 'success', 'result', 'error', and 'result_type'
+            Dict with 'success', 'result', 'result_preview', 'error', and 'result_type'
         """
         try:
             # Create safe execution namespace
             namespace = {
                 'pd': pd,
                 'np': np,
-                'df': self.df.copy(),  # Work on copy to prevent modifications
+                'df': self._namespace_df(code),
+                'jit': jit_helpers,
+                **self._precomputed(code),
                 'result': None
             }
             
             # Execute code
-            exec(code, namespace)
+            exec(_compile_code(code), namespace)
             result = namespace.get('result')
             
             if result is None:
                 return {
                     'success': False,
                     'result': None,
+                    'result_preview': None,
                     'error': 'Code executed but no result was stored in "result" variable',
                     'result_type': None
                 }
@@ -92,11 +515,16 @@ class DataAnalysisTools:
             # Determine result type and format
             result_type = type(result).__name__
             
+            # Slice before formatting so wide/long results never render in full
             if isinstance(result, pd.DataFrame):
-                formatted_result = result.to_string(max_rows=50)
+                formatted_result = result.iloc[:RESULT_MAX_ROWS, :RESULT_MAX_COLS].to_string(max_colwidth=RESULT_MAX_COLWIDTH)
+                if result.shape[0] > RESULT_MAX_ROWS or result.shape[1] > RESULT_MAX_COLS:
+                    formatted_result += f"\n[{result.shape[0]:,} rows x {result.shape[1]} columns]"
                 result_data = result
             elif isinstance(result, pd.Series):
-                formatted_result = result.to_string(max_rows=50)
+                formatted_result = result.head(RESULT_MAX_ROWS).to_string()
+                if len(result) > RESULT_MAX_ROWS:
+                    formatted_result += f"\n[{len(result):,} rows]"
                 result_data = result
             elif isinstance(result, (int, float)):
                 formatted_result = f"{result:,.4f}".rstrip('0').rstrip('.')
@@ -111,66 +539,57 @@ class DataAnalysisTools:
             return {
                 'success': True,
                 'result': formatted_result,
+                'result_preview': formatted_result[:RESULT_PREVIEW_CHARS],
                 'result_data': result_data,
                 'error': None,
                 'result_type': result_type
             }
             
         except Exception as e:
-            error_msg = f"{type(e).__name__}: {str(e)}\n{traceback.format_exc()}"
+            logger.exception("Generated analysis code failed")
+            error_msg = _summarize_error(e, code)
             return {
                 'success': False,
                 'result': None,
+                'result_preview': None,
                 'error': error_msg,
                 'result_type': None
             }
     
-    def execute_visualization_code(self, viz_code: str) -> Dict[str, Any]:
+    async def aexecute_visualization_code(self, viz_code: str) -> Dict[str, Any]:
         """
-        Execute matplotlib/seaborn visualization code and return base64 image or error
+        Async execute_visualization_code: renders in a worker process so the event loop
+        and other requests are not blocked
         
-        Args:
-            viz_code: Python code that creates a matplotlib/seaborn visualization
-            
         Returns:
-            Dict with 'success', 'image' (base64), and 'error'
+            Same dict as execute_visualization_code
         """
+        pool = self._viz_pool
+        if pool is None:
+            return self.execute_visualization_code(viz_code)
+        
+        loop = asyncio.get_running_loop()
         try:
-            # Create safe execution namespace with visualization libraries
-            namespace = {
-                'pd': pd,
-                'np': np,
-                'df': self.df.copy(),
-                'plt': plt,
-                'sns': sns,
-                'fig': None,
-                'ax': None
-            }
-            
-            # Execute visualization code
-            exec(viz_code, namespace)
-            
-            # Convert to base64
-            buffer = BytesIO()
-            plt.savefig(buffer, format='png', dpi=120, bbox_inches='tight')
-            buffer.seek(0)
-            image_base64 = base64.b64encode(buffer.read()).decode()
-            plt.close('all')
-            
-            return {
-                'success': True,
-                'image': image_base64,
-                'error': None
-            }
-            
+            return await loop.run_in_executor(pool, _render_visualization, viz_code)
+        except BrokenProcessPool:
+            # A worker died mid-render (e.g. crashed in native code); replace the pool.
+            # Every render in flight on it fails together, and only the first replaces it.
+            logger.exception("Visualization worker crashed")
+            if self._viz_pool is pool:
+                pool.shutdown(wait=False, cancel_futures=True)
+                try:
+                    self._start_viz_pool()
+                except Exception:
+                    logger.exception("Could not restart visualization workers; rendering in-process")
+                    self.close()
+            error = 'Visualization worker crashed while rendering'
         except Exception as e:
-            error_msg = f"{type(e).__name__}: {str(e)}\n{traceback.format_exc()}"
-            print(f"Visualization execution error: {e}")
-            traceback.print_exc()
-            plt.close('all')
-            
-            return {
-                'success': False,
-                'image': None,
-                'error': error_msg
-            }
\ No newline at end of file
+            logger.exception("Visualization worker failed")
+            error = f"{type(e).__name__}: {e}"
+        
+        return {
+            'success': False,
+            'image': None,
+            'image_format': None,
+            'error': error
+        }
\ No newline at end of file
@@ -9,12 +9,36 @@ interface Message {
   role: 'user' | 'assistant';
   content: string;
   visualization?: string;
+  visualizationFormat?: 'png' | 'svg';
   codeExecuted?: string;
   visualizationCode?: string;
   timestamp: Date;
   isError?: boolean;
 }
 
+interface ChatResult {
+  response: string;
+  visualization?: string;
+  visualization_format?: 'png' | 'svg';
+  code_executed?: string;
+  visualization_code?: string;
+  success: boolean;
+}
+
+// Status shown after each agent step finishes
+const STEP_LABELS: {[node: string]: string} = {
+  plan_analysis: 'Analysis planned • Writing code',
+  generate_code: 'Code written • Running it on the dataset',
+  retry_code: 'Fixing the code and retrying',
+  execute_code: 'Code executed • Deciding on visualization',
+  decide_visualization: 'Preparing the answer',
+  generate_visualization: 'Chart rendered',
+  draft_response: 'Answer drafted',
+};
+
+// Steps whose LLM tokens are the user-facing answer
+const RESPONSE_NODES = ['draft_response', 'format_response'];
+
 export default function DataAnalyticsAgent() {
   const [messages, setMessages] = useState<Message[]>([
     {
@@ -25,6 +49,8 @@ export default function DataAnalyticsAgent() {
   ]);
   const [input, setInput] = useState('');
   const [isLoading, setIsLoading] = useState(false);
+  const [progress, setProgress] = useState('');
+  const [streamingText, setStreamingText] = useState('');
   const [backendStatus, setBackendStatus] = useState<'checking' | 'connected' | 'disconnected'>('checking');
   const [showCode, setShowCode] = useState<{[key: number]: boolean}>({});
   const [showVizCode, setShowVizCode] = useState<{[key: number]: boolean}>({});
@@ -73,7 +99,7 @@ export default function DataAnalyticsAgent() {
     setIsLoading(true);
 
     try {
-      const response = await fetch('http://localhost:8000/api/chat', {
+      const response = await fetch('http://localhost:8000/api/chat/stream', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -81,16 +107,52 @@ export default function DataAnalyticsAgent() {
         body: JSON.stringify({ message: currentInput }),
       });
 
-      if (!response.ok) {
+      if (!response.ok || !response.body) {
         throw new Error('Failed to get response from backend');
       }
 
-      const data = await response.json();
+      // Read Server-Sent Events: progress per step, response tokens, then the final result
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let streamingNode = '';
+      let data: ChatResult | null = null;
+
+      while (data === null) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        const events = buffer.split('\n\n');
+        buffer = events.pop() ?? '';
+
+        for (const raw of events) {
+          if (!raw.startsWith('data: ')) continue;
+          const event = JSON.parse(raw.slice(6));
+
+          if (event.event === 'node' && STEP_LABELS[event.node]) {
+            setProgress(STEP_LABELS[event.node]);
+          } else if (event.event === 'token' && RESPONSE_NODES.includes(event.node)) {
+            // A final re-format after a failed chart replaces the draft preview
+            const token: string = event.token;
+            const continuesPreview = event.node === streamingNode;
+            streamingNode = event.node;
+            setStreamingText(prev => continuesPreview ? prev + token : token);
+          } else if (event.event === 'result') {
+            data = event.result;
+          }
+        }
+      }
+
+      if (data === null) {
+        throw new Error('Stream ended before a result was received');
+      }
 
       const assistantMessage: Message = {
         role: 'assistant',
         content: data.response,
         visualization: data.visualization,
+        visualizationFormat: data.visualization_format,
         codeExecuted: data.code_executed,
         visualizationCode: data.visualization_code,
         timestamp: new Date()
@@ -107,6 +169,8 @@ export default function DataAnalyticsAgent() {
       setMessages(prev => [...prev, errorMessage]);
     } finally {
       setIsLoading(false);
+      setProgress('');
+      setStreamingText('');
     }
   };
 
@@ -215,7 +279,7 @@ export default function DataAnalyticsAgent() {
                         <span className="text-sm font-semibold text-purple-300">Generated Visualization</span>
                       </div>
                       <img 
-                        src={`data:image/png;base64,${message.visualization}`} 
+                        src={`data:${message.visualizationFormat === 'svg' ? 'image/svg+xml' : 'image/png'};base64,${message.visualization}`} 
                         alt="Data Visualization" 
                         className="w-full rounded-lg shadow-lg"
                       />
@@ -264,8 +328,15 @@ export default function DataAnalyticsAgent() {
                   <div>
                     <div className="font-medium">Analyzing your query...</div>
                     <div className="text-xs opacity-70 mt-1">
-                      AI is writing custom code • Deciding on visualization
+                      {progress || 'AI is writing custom code • Deciding on visualization'}
                     </div>
+                    {streamingText && (
+                      <div className="prose prose-invert max-w-none leading-relaxed mt-3">
+                        <ReactMarkdown remarkPlugins={[remarkGfm]}>
+                          {streamingText}
+                        </ReactMarkdown>
+                      </div>
+                    )}
                   </div>
                 </div>
               </div>